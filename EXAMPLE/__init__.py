@@ -1,17 +1,37 @@
 from __future__ import annotations
 
+import atexit
+import base64
+import binascii
+import hashlib
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
 from http.cookiejar import MozillaCookieJar
 from typing import Any, Optional, Union
 
 import click
 import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 from devine.core.constants import AnyTrack
+from devine.core.manifests import DASH
 from devine.core.service import Service
-from devine.core.titles import Movies, Series
+from devine.core.titles import Episode, Movie, Movies, Series
 from devine.core.tracks import Chapter, Tracks
 from devine.core.credential import Credential
 
+try:
+    # orjson is a drop-in and much faster parser, which matters for large catalog responses
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 
 class SERVICE_TAG(Service):
     """
@@ -44,9 +64,22 @@ class SERVICE_TAG(Service):
     # List of regions of which the service offers support for.
     GEOFENCE = ("us",)
 
+    # Regex of the Title argument, with a named `title_id` group. It should accept both a URL and the bare ID.
+    # Make sure the ID is anchored, otherwise an unsupported URL could match the bare ID's branch as `https`.
+    # Compile any regex you use once here (or at module-level) rather than inline where it's used.
+    TITLE_RE = re.compile(
+        r"^(?:https?://(?:www\.)?website\.com/(?:movie|series)/)?(?P<title_id>[A-Za-z0-9-]+)(?:[/?#]|$)"
+    )
+
+    # License request body, filled in with bytes %-formatting. Only do this with values that never need JSON
+    # escaping, like base64 data or JWT tokens.
+    LICENSE_BODY = b'{"token":"%b","challenge":"%b"}'
+
     @staticmethod
     @click.command(name="SERVICE_TAG", short_help="https://website.com", help=__doc__)
     @click.argument("title", type=str)
+    @click.option("--prefetch", is_flag=True, default=False,
+                  help="Request the next episode's license token while the current episode downloads.")
     @click.pass_context
     def cli(ctx: click.Context, **kwargs: Any) -> SERVICE_TAG:
         """
@@ -54,12 +87,17 @@ class SERVICE_TAG(Service):
 
         The entire purpose of this is just to define the CLI arguments for the service
         and pass them to the Service class's constructor.
+
+        The decorators run once, when the class body is executed on import, so the command
+        is already built a single time. Keep it here as devine looks for it as `cli` on the
+        Service class.
         """
         return SERVICE_TAG(ctx, **kwargs)
 
-    def __init__(self, ctx: click.Context, title: str):
+    def __init__(self, ctx: click.Context, title: str, prefetch: bool):
         # Store argument data to class instance variables at the top of the constructor
         self.title = title
+        self.prefetch = prefetch
 
         # (important) This calls the base-service constructor, make sure this is after the above!
         super().__init__(ctx)
@@ -101,6 +139,21 @@ class SERVICE_TAG(Service):
         with constructor. Instead do multiple smaller functions.
         """
 
+        # Every track of a title shares the same license authorization, keyed by title ID. They are stored as
+        # Futures so a token that is still being prefetched is waited on rather than requested a second time.
+        self.license_tokens: dict[str, Future[str]] = {}
+        self.license_tokens_lock = threading.Lock()
+        self.license_token_pool = ThreadPoolExecutor(max_workers=2)
+
+        # Set by get_widevine_service_certificate() once first obtained from the cache or license server
+        self.service_certificate: str
+        self.service_certificate_lock = threading.Lock()
+
+        title_match = self.TITLE_RE.match(self.title)
+        if not title_match:
+            raise ValueError(f"Could not parse a Title ID from {self.title!r}.")
+        self.title_id = title_match.group("title_id")
+
     # What next? Implement the following methods.
     # See the same named methods in the base Service class for more information on them.
     # The base Service class has a lot of information that you should read.
@@ -114,7 +167,32 @@ class SERVICE_TAG(Service):
         # modify the creation of the requests session (stored as self.session)
         # make a super() call to take the original result and further modify it,
         # or don't to make a completely fresh one if required.
-        ...
+        # It must stay a requests.Session (e.g., not an httpx.Client), as devine itself uses this session
+        # for manifests, downloads, and more.
+        session = super().get_session()
+
+        # Every call made with self.session re-uses the pooled connections of these adapters, so only the
+        # first request to each host pays for the TCP and TLS handshakes. Keep pool_maxsize at or above the
+        # amount of requests you make concurrently, otherwise the extra connections are simply discarded.
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["GET", "POST"])
+            )
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        session.headers["User-Agent"] = self.config["client"]["user_agent"]
+
+        # close the pooled sockets once devine exits rather than leaving it to the garbage collector
+        atexit.register(session.close)
+
+        return session
 
     def authenticate(self, cookies: Optional[MozillaCookieJar] = None, credential: Optional[Credential] = None) -> None:
         # obtain authentication data like auth bearers or tokens using cookies and/or credentials.
@@ -123,19 +201,111 @@ class SERVICE_TAG(Service):
         # Only use this to get authentication data or setting up authentication state enough for the
         # future functions to be authorized.
         super().authenticate(cookies, credential)  # important
-        ...
+        # The super() call copied any cookies into self.session.cookies, which is the requests session's own
+        # RequestsCookieJar. Don't keep a reference to `cookies` around or attach it to requests yourself,
+        # read cookie values back with e.g., `self.session.cookies.get("name")` when needed.
+
+        if credential:
+            cache_key = credential.sha1
+        elif cookies:
+            # key the cache by the session cookie so that cookies of another account get their own tokens.
+            # cookies.get() raises a CookieConflictError if a browser export has a `session` cookie for more
+            # than one domain or path, so look for the one of this service's domain instead.
+            session_cookie = next((
+                x.value
+                for x in self.session.cookies
+                if x.name == "session" and x.domain.lstrip(".").endswith("website.com")
+            ), None)
+            if not session_cookie:
+                raise EnvironmentError("The Cookies are missing the 'session' cookie, are you logged in?")
+            cache_key = hashlib.sha1(session_cookie.encode()).hexdigest()
+        else:
+            raise EnvironmentError("Service requires Cookies or Credentials for Authentication.")
+
+        cache = self.cache.get(f"tokens_{cache_key}")
+        if cache and not cache.expired:
+            self.log.info(" + Using cached Tokens...")
+            tokens = cache.data
+        else:
+            self.log.info(" + Logging in...")
+            if credential:
+                res = self.session.post(
+                    url=self.config["endpoints"]["login"],
+                    json={
+                        "username": credential.username,
+                        "password": credential.password
+                    }
+                )
+            else:
+                # the session sends the cookies, which get exchanged for tokens
+                res = self.session.post(self.config["endpoints"]["token"])
+            if not res.ok:
+                raise EnvironmentError(f"Failed to log in, {res.status_code}: {res.text}")
+            tokens = json_loads(res.content)
+            if "access_token" not in tokens:
+                raise EnvironmentError(f"Failed to log in, no Access Token was returned: {tokens}")
+            # expire the cached tokens a minute early so they cannot expire part-way through a download,
+            # but never at 0 seconds, as that means no expiration at all
+            cache.set(tokens, expiration=max(self.get_token_lifetime(tokens) - 60, 1))
+
+        self.session.headers["Authorization"] = f"Bearer {tokens['access_token']}"
 
     # Required methods:
 
     def get_titles(self) -> Union[Movies, Series]:
         # the return type hint should only be what this service returns e.g.,
         # if it's a music service do `-> Album`, or Movie/TV do `-> Union[Movies, Series]`.
-        ...
+        res = self.session.get(self.config["endpoints"]["title"].format(title_id=self.title_id))
+        res.raise_for_status()
+        title = json_loads(res.content)
+
+        if title["type"] == "movie":
+            return Movies([Movie(
+                id_=title["id"],
+                service=self.__class__,
+                name=title["name"],
+                year=title["year"],
+                language=title["language"],
+                data=title
+            )])
+
+        # Each season is a separate request, so fetch them concurrently rather than one after the other.
+        # executor.map() keeps the season order and re-raises the first failed request. Keep max_workers
+        # within the adapter's pool_maxsize (see get_session()) so every worker re-uses a pooled connection.
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            seasons = list(executor.map(self.get_season_episodes, [x["id"] for x in title["seasons"]]))
+
+        return Series([
+            Episode(
+                id_=episode["id"],
+                service=self.__class__,
+                title=title["name"],
+                season=episode["seasonNumber"],
+                number=episode["episodeNumber"],
+                name=episode["name"],
+                year=title["year"],
+                language=title["language"],
+                data=episode
+            )
+            for season in seasons
+            for episode in season
+        ])
 
     def get_tracks(self, title: Union[Movies, Series]) -> Tracks:
         # the type hint for `title` param must match the return type of get_titles().
         # the same goes for any further function with a `title` param.
-        ...
+        res = self.session.get(self.config["endpoints"]["playback"].format(title_id=title.id))
+        res.raise_for_status()
+        playback = json_loads(res.content)
+
+        if self.prefetch and title.data.get("nextEpisodeId"):
+            # devine downloads this title before asking for the next one, so get the next title's license
+            # token in the background now and it's likely ready by the time it's needed
+            self.prefetch_license_token(title.data["nextEpisodeId"])
+
+        manifest, manifest_url = self.get_manifest(title.id, playback["manifest"])
+
+        return DASH(manifest, manifest_url).to_tracks(title.language)
 
     def get_chapters(self, title: Union[Movies, Series]) -> list[Chapter]:
         # technically optional, but you must define and at least `return []`.
@@ -155,7 +325,32 @@ class SERVICE_TAG(Service):
         # The return type should be accurate. You can return either str or bytes, but the return type should
         # be specific to one of the two, whatever the service's API returns it as. Avoid base64 decoding yourself
         # and such, as all of that is done for you.
-        ...
+
+        # This is called for every track, so keep the certificate on the instance after the first call.
+        certificate = getattr(self, "service_certificate", None)
+        if certificate:
+            return certificate
+
+        # devine licenses tracks from multiple threads, so only let one of them load or request the certificate,
+        # the others wait for it and then return it from the instance
+        with self.service_certificate_lock:
+            certificate = getattr(self, "service_certificate", None)
+            if certificate:
+                return certificate
+
+            # The certificate rarely changes, so cache it to save a license round-trip on every run. The cache
+            # is already separated per-service, so the key only has to be unique within this service.
+            cache = self.cache.get("widevine_service_certificate")
+            if cache and not cache.expired:
+                certificate = cache.data
+            else:
+                certificate = self.get_widevine_license(challenge=challenge, title=title, track=track)
+                if isinstance(certificate, bytes):
+                    certificate = binascii.b2a_base64(certificate, newline=False).decode()
+                cache.set(certificate, expiration=int(timedelta(days=30).total_seconds()))
+
+            self.service_certificate = certificate
+            return certificate
 
     def get_widevine_license(self, *, challenge: bytes, title: Union[Movies, Series], track: AnyTrack) -> Optional[Union[bytes, str]]:
         # Send the license challenge (base64-encode it if needed) and return the license. You should check for and
@@ -164,7 +359,38 @@ class SERVICE_TAG(Service):
         # The return type should be accurate. You can return either str or bytes, but the return type should
         # be specific to one of the two, whatever the service's API returns it as. Avoid base64 decoding yourself
         # and such, as all of that is done for you.
-        ...
+
+        # A license is bound to the challenge (and therefore the CDM session) it was issued for, so it can
+        # never be re-used for another track. What can be shared is everything leading up to the license
+        # call, like the per-title license token here, which saves a round-trip for every further track.
+        res = self.session.post(
+            url=self.config["endpoints"]["license"],
+            data=self.LICENSE_BODY % (
+                self.get_license_token(title.id).encode(),
+                binascii.b2a_base64(challenge, newline=False)
+            ),
+            headers={
+                "Content-Type": "application/json"
+            }
+        )
+
+        try:
+            data = json_loads(res.content)
+        except ValueError:
+            data = {}  # not JSON, e.g., an error page from a CDN or proxy
+
+        if not res.ok or "license" not in data:
+            error = data.get("errorCode") or f"HTTP {res.status_code}"
+            if res.status_code == 403 or error == "INVALID_CERT":
+                # The service certificate may have been rotated, so drop it from the cache and the instance. This
+                # track's challenge was already made with the old certificate and cannot be re-sent, but the next
+                # call to get_widevine_service_certificate(), for the next track or run, will fetch a fresh one.
+                self.cache.get("widevine_service_certificate").set(None)
+                vars(self).pop("service_certificate", None)
+            self.log.error(f"Failed to obtain a License, {error}: {data.get('message') or res.text[:200]}")
+            raise EnvironmentError(error)
+
+        return data["license"]
 
     # Service specific functions
     # These are functions of which will only be used by this service.
@@ -172,9 +398,138 @@ class SERVICE_TAG(Service):
     # Don't be shy at creating many small functions instead of over-complicating other functions.
     # I recommend keeping the above 'Service specific functions' comment to have a clear divider.
 
-    def get_api_config_data(self, device_id: str, version: int):
+    def get_api_config_data(self, device_id: str, version: int) -> dict:
         # example
-        ...
+        # The config rarely changes, so keep the last response and ask the server to only send it again if it
+        # has changed. A 304 Not Modified response has no body, saving both the download and the parse.
+        cache = self.cache.get(f"config_{device_id}_{version}")
+
+        headers = {}
+        if cache:
+            if cache.data["etag"]:
+                headers["If-None-Match"] = cache.data["etag"]
+            if cache.data["last_modified"]:
+                headers["If-Modified-Since"] = cache.data["last_modified"]
+
+        res = self.session.get(
+            url=self.config["endpoints"]["config"].format(device_id=device_id, version=version),
+            headers=headers
+        )
+        if cache and res.status_code == 304:
+            return cache.data["body"]
+        res.raise_for_status()
+
+        config = json_loads(res.content)
+
+        # without an ETag or Last-Modified it couldn't be revalidated later, so there's no point caching it
+        etag = res.headers.get("ETag")
+        last_modified = res.headers.get("Last-Modified")
+        if etag or last_modified:
+            cache.set({
+                "etag": etag,
+                "last_modified": last_modified,
+                "body": config
+            })
+
+        return config
+
+    @staticmethod
+    def get_token_lifetime(tokens: dict) -> int:
+        """
+        Get the seconds until the Access Token expires, from `expires_in` or else the JWT `exp` claim.
+
+        Opaque tokens without an `expires_in` get a conservative lifetime of 10 minutes.
+        """
+        if "expires_in" in tokens:
+            return int(tokens["expires_in"])
+        try:
+            payload = tokens["access_token"].split(".")[1]
+            claims = json_loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return int(claims["exp"] - time.time())
+        except (IndexError, KeyError, TypeError, ValueError):
+            return 600
+
+    def get_season_episodes(self, season_id: str) -> list[dict]:
+        """Get the Episode metadata of a Season."""
+        res = self.session.get(self.config["endpoints"]["season"].format(season_id=season_id))
+        res.raise_for_status()
+        return json_loads(res.content)["episodes"]
+
+    def get_manifest(self, title_id: str, url: str) -> tuple[etree._Element, str]:
+        """
+        Get the parsed DASH manifest of a title, and its URL after any redirects.
+
+        The manifest is fed to the parser as it downloads instead of holding the full response, then
+        a decoded copy of it, in memory before parsing. A compressed copy is cached with its ETag so
+        that an unchanged manifest isn't downloaded again on the next run. The cache is keyed by the
+        title rather than the URL, as manifest URLs are often signed and differ on every request.
+        """
+        cache = self.cache.get(f"manifest_{title_id}")
+
+        headers = {}
+        if cache and not cache.expired:
+            headers["If-None-Match"] = cache.data["etag"]
+
+        parser = etree.XMLParser()
+        with self.session.get(url, headers=headers, stream=True) as res:
+            if headers and res.status_code == 304:
+                parser.feed(zlib.decompress(base64.b64decode(cache.data["manifest"])))
+            else:
+                res.raise_for_status()
+                # without an ETag it couldn't be revalidated later, so don't bother compressing it for the cache
+                etag = res.headers.get("ETag")
+                compressor = zlib.compressobj() if etag else None
+                compressed = []
+                for chunk in res.iter_content(64 * 1024):
+                    parser.feed(chunk)
+                    if compressor:
+                        compressed.append(compressor.compress(chunk))
+                if compressor:
+                    compressed.append(compressor.flush())
+                    cache.set({
+                        "etag": etag,
+                        "manifest": base64.b64encode(b"".join(compressed)).decode()
+                    }, expiration=int(timedelta(days=7).total_seconds()))
+
+        return self.strip_namespaces(parser.close()), res.url
+
+    @staticmethod
+    def strip_namespaces(manifest: etree._Element) -> etree._Element:
+        """
+        Strip the XML namespaces from all tags and attributes of a manifest, like devine's load_xml().
+
+        devine's DASH class expects an `MPD` root tag and looks up child elements like `Period`
+        without namespaces, so always do this when not using DASH.from_url() or DASH.from_text().
+        """
+        for elem in manifest.iter():
+            if not isinstance(elem.tag, str):
+                continue  # comments and processing instructions
+            elem.tag = elem.tag.split("}")[-1]
+            for name in [x for x in elem.attrib if x.startswith("{")]:
+                elem.attrib[name.split("}")[-1]] = elem.attrib.pop(name)
+        etree.cleanup_namespaces(manifest)
+        return manifest
+
+    def get_license_token(self, title_id: str) -> str:
+        """Get the License Token authorizing license requests for a title, requested once per title."""
+        return self.prefetch_license_token(title_id).result()
+
+    def prefetch_license_token(self, title_id: str) -> Future[str]:
+        """Start requesting the License Token for a title in the background, unless already requested."""
+        # devine licenses tracks from multiple threads, so check and submit under a lock to request only once
+        with self.license_tokens_lock:
+            future = self.license_tokens.get(title_id)
+            # a request that failed isn't kept around, the next caller requests it again
+            if not future or (future.done() and future.exception()):
+                future = self.license_token_pool.submit(self.request_license_token, title_id)
+                self.license_tokens[title_id] = future
+        return future
+
+    def request_license_token(self, title_id: str) -> str:
+        """Request a new License Token for a title."""
+        res = self.session.get(self.config["endpoints"]["license_token"].format(title_id=title_id))
+        res.raise_for_status()
+        return json_loads(res.content)["token"]
 
     # Service specific classes
     # This is similar to the above, but for service classes.
@@ -182,4 +537,10 @@ class SERVICE_TAG(Service):
 
     class ServiceApiWrapper:
         # example
-        ...
+        # If a class gets instanced a lot, e.g., once per episode, define __slots__ so that each
+        # instance doesn't carry its own __dict__.
+        __slots__ = ("id", "data")
+
+        def __init__(self, id_: str, data: dict):
+            self.id = id_
+            self.data = data